@@ -1,6 +1,10 @@
 import struct
 import io
+import mmap
 from psfreader.psfdata import *
+from psfreader.cache import SignalCache, shared_cache
+from psfreader import resample
+from psfreader.writer import PSFWriter
 
 
 class PSFReaderError(ValueError):
@@ -19,6 +23,8 @@ class PSFFile:
         self.traces = list()
         self.sweep_value = None
         self.sweep_value_w_var = None
+        self.valid = None
+        self.events = None  # 非ウィンドウ形式の文字列の信号の変化点(EventSignal)
         self.value = None
         self.variables = None
         self.read_points = 0
@@ -85,6 +91,8 @@ class PSFFile:
             r = self.read_double()
             i = self.read_double()
             return complex(r, i)
+        elif t == TypeId.STRING:
+            return self.read_str()
 
     def read_data_win(self, array, start, size, t):
         if t == TypeId.INT8:
@@ -114,32 +122,7 @@ class PSFFile:
 
         self.completed = True
         if self.has_footer:
-            size = self.fsize
-            self.fp.seek(self.fsize - 4, io.SEEK_SET)
-            datasize = self.read_uint32()
-
-            num_section = (size - datasize - 12) // 8  # //は整数上の除算(端数切り捨て)
-            # 12は文字列'Clarissa'の分？
-            last_offset = 0
-            last_section_num = -1
-
-            toc = size - 12 - num_section * 8  # セクション情報の頭の位置
-
-            sections = dict()
-            section_id = -1
-            for i in range(num_section):
-                self.fp.seek(toc + 8 * i)
-                section_id = self.read_uint32()
-                section_offset = self.read_uint32()
-
-                if i > 1:  # 2つのセクションの位置の差がサイズである
-                    sections[last_section_num].size = section_offset - last_offset
-                sections[section_id] = SectionInfo(section_offset, 0)
-
-                last_section_num = section_id
-                last_offset = section_offset
-            sections[last_section_num].size = size - last_offset  # 最後のセクション
-            self.sections = sections
+            self.read_toc()
 
             # セクションごとの前処理
             self.fp.seek(4, io.SEEK_SET)
@@ -168,6 +151,37 @@ class PSFFile:
             while self.read_section():
                 pass
 
+    def read_toc(self):
+        '''
+        フッタのTOCを読み込み，各セクションの位置を求める
+        '''
+        size = self.fsize
+        self.fp.seek(self.fsize - 4, io.SEEK_SET)
+        datasize = self.read_uint32()
+
+        num_section = (size - datasize - 12) // 8  # //は整数上の除算(端数切り捨て)
+        # 12は文字列'Clarissa'の分？
+        last_offset = 0
+        last_section_num = -1
+
+        toc = size - 12 - num_section * 8  # セクション情報の頭の位置
+
+        sections = dict()
+        section_id = -1
+        for i in range(num_section):
+            self.fp.seek(toc + 8 * i)
+            section_id = self.read_uint32()
+            section_offset = self.read_uint32()
+
+            if i > 1:  # 2つのセクションの位置の差がサイズである
+                sections[last_section_num].size = section_offset - last_offset
+            sections[section_id] = SectionInfo(section_offset, 0)
+
+            last_section_num = section_id
+            last_offset = section_offset
+        sections[last_section_num].size = size - last_offset  # 最後のセクション
+        self.sections = sections
+
     def read_chunk_preamble(self, chunkid):
         c_id = self.read_uint32()
         if c_id != chunkid:
@@ -279,7 +293,7 @@ class PSFFile:
                 var = PSF_Variable()
                 var.id = var_id
                 var.name = name
-                var.type_id = id
+                var.type_id = psf_type_id
                 var.prop = prop
 
                 res.append((var, data))
@@ -344,7 +358,7 @@ class PSFFile:
         t = typeid_to_dtype(sweep_type)
         sweep = np.empty(npoints, dtype=t)
         sweep_var = self.sweep_vars[0]
-        value_map = self.array_list_from_trace_group(npoints, self.traces)
+        value_map = self.array_list_from_trace_group(npoints, self.traces, events=True)
         i = -1
 
         try:
@@ -366,13 +380,442 @@ class PSFFile:
         n = i + 1
         self.sweep_value = sweep[:n]
         self.read_points = n
-        self.variables, self.value, self.sweep_value_w_var = self.flatten_value_group(value_map, self.sweep_value)
+        (self.variables, self.value, self.sweep_value_w_var, self.valid, self.events) = \
+            self.flatten_value_group(value_map, self.sweep_value)
+
+    def iter_value(self, chunk_points=65536):
+        '''
+        値セクションを先頭から順に読み込み，チャンクごとに返すジェネレータ
+
+        (sweep, {name: values}, valid)をおよそchunk_points点ずつ返す．
+        validは非ウィンドウ形式では{name: 有効なサンプルのマスク}，それ以外はNone．
+        スイープのないファイルではsweepがNoneの1チャンクを返す．
+        '''
+        self.completed = True
+        endpos = self.seek_value_section()
+        if endpos is None:
+            return
+
+        if len(self.sweep_vars) == 0:
+            self.read_non_sweep_value()
+            yield None, {v.name: np.asarray([x]) for (v, x) in self.variables if x is not None}, None
+            return
+        elif len(self.sweep_vars) != 1:
+            raise PSFReaderError('Not supported file format: Sweep variables is more than one.')
+
+        npoints = self.properties['PSF sweep points'].value
+        if 'PSF window size' in self.properties:
+            win_size = self.properties['PSF window size'].value
+        else:
+            win_size = 0
+
+        if win_size > 0:
+            yield from self.iter_sweep_value_win(win_size, npoints, chunk_points)
+        else:
+            yield from self.iter_sweep_value_non_win(chunk_points)
+
+    def iter_sweep_value_win(self, win_size, npoints, chunk_points):
+        sweep_type = self.types[self.sweep_vars[0].type_id].data_type
+        sweep_dtype = typeid_to_file_dtype(sweep_type)
+        variables = [(v.name, typeid_to_file_dtype(self.types[v.type_id].data_type))
+                     for (v, _) in self.trace_to_signal_names()]
+
+        def merge(blocks):
+            if len(blocks) == 1:
+                return blocks[0]
+            sweep = np.concatenate([b[0] for b in blocks])
+            values = {name: np.concatenate([b[1][name] for b in blocks]) for (name, _) in variables}
+            return sweep, values, None
+
+        blocks = list()
+        buffered = 0
+        read_points = 0
+        while read_points < npoints:
+            head = self.fp.read(8)
+            if len(head) < 8:
+                self.completed = False
+                break
+            (block_id, size) = struct.unpack('>II', head)
+
+            if block_id == ElementId.DATA:
+                size &= 0x0000ffff
+                skip_size = win_size - sweep_dtype.itemsize * size
+                length = size * sweep_dtype.itemsize + sum(skip_size + size * t.itemsize for (_, t) in variables)
+                data = self.fp.read(length)
+                if len(data) < length:
+                    self.completed = False
+                    break
+
+                # ブロックを一度に読み込み，各信号はその中のビューとする
+                sweep = np.frombuffer(data, dtype=sweep_dtype, count=size)
+                offset = size * sweep_dtype.itemsize
+                values = dict()
+                for (name, t) in variables:
+                    offset += skip_size
+                    values[name] = np.frombuffer(data, dtype=t, count=size, offset=offset)
+                    offset += size * t.itemsize
+
+                blocks.append((sweep, values, None))
+                buffered += size
+                read_points += size
+                if buffered >= chunk_points:
+                    yield merge(blocks)
+                    blocks = list()
+                    buffered = 0
+            elif block_id == ElementId.ZEROPAD:
+                self.fp.seek(size, io.SEEK_CUR)
+            else:
+                self.completed = False
+                break
+
+        self.read_points = read_points
+        if blocks:
+            yield merge(blocks)
+
+    def iter_sweep_value_non_win(self, chunk_points):
+        sweep_var = self.sweep_vars[0]
+        sweep_type = self.types[sweep_var.type_id].data_type
+        read_points = 0
+
+        def new_chunk():
+            sweep = np.empty(chunk_points, dtype=typeid_to_dtype(sweep_type))
+            return sweep, self.array_list_from_trace_group(chunk_points, self.traces)
+
+        def flatten(sweep, value_map, n):
+            values = dict()
+            valid = dict()
+            for (v, a) in value_map.values():
+                for (x, (data_array, data_valid)) in (a if v.is_group else [(v, a)]):
+                    (data_array, data_valid) = (data_array[:n], data_valid[:n])
+                    if data_array.dtype == object:
+                        data_array = np.where(data_valid, data_array, '').astype(str)
+                    values[x.name] = data_array
+                    valid[x.name] = data_valid
+            return sweep[:n], values, valid
+
+        (sweep, value_map) = new_chunk()
+        i = -1
+        try:
+            while self.fp.tell() < self.fsize:
+                elemid = self.read_uint32()
+                var_id = self.read_uint32()
+
+                if elemid == ElementId.DATA and var_id == sweep_var.id:
+                    if i + 1 == chunk_points:
+                        yield flatten(sweep, value_map, chunk_points)
+                        (sweep, value_map) = new_chunk()
+                        i = -1
+                    i += 1
+                    read_points += 1
+                    sweep[i] = self.read_data(sweep_type)
+                elif elemid == ElementId.GROUP or elemid == ElementId.DATA:
+                    (v, array) = value_map[var_id]
+                    v.read_data(array, i, self)
+                else:
+                    break
+        except struct.error:
+            self.completed = False
+
+        self.read_points = read_points
+        if i >= 0:
+            yield flatten(sweep, value_map, i + 1)
+
+    def validate(self, report):
+        '''
+        ブロック/レコードのヘッダのみを走査し，ファイルの構造を検査する
+
+        値は読み飛ばすため，信号の配列は確保しない
+        '''
+        try:
+            if self.has_footer:
+                self.read_toc()
+                self.check_toc(report)
+
+            endpos = self.seek_value_section()
+            if endpos is not None:
+                self.scan_value(report, endpos)
+        except (struct.error, KeyError, ValueError) as e:
+            report.truncated = report.truncated or self.fp.tell() >= self.fsize
+            report.add_error(self.fp.tell(), repr(e))
+
+    def seek_value_section(self):
+        '''
+        値セクションより前のセクションを読み込み，値セクションの中身の先頭に移動する
+
+        値セクションの終端位置を返す．値セクションがなければNone
+        '''
+        if self.has_footer:
+            self.read_file(header_only=True)
+            if SectionId.VALUE not in self.sections:
+                return None
+            return self.read_section_preamble(SectionId.VALUE)
+        else:
+            self.fp.seek(4, io.SEEK_SET)
+            self.read_properties()
+
+            while True:
+                self.fp.seek(-4, io.SEEK_CUR)
+                section_num = self.read_uint32()
+                if section_num == SectionId.VALUE:
+                    return self.read_chunk_preamble(ChunkId.MAJOR_SECTION)
+                elif not self.read_section():
+                    return None
+
+    def check_toc(self, report):
+        toc = self.fsize - 12 - 8 * len(self.sections)
+        last_offset = 0
+        for (section_id, info) in self.sections.items():
+            if section_id not in set(SectionId):
+                report.add_error(info.offset, 'Unknown section id in TOC: ' + repr(section_id))
+                continue
+            if not (last_offset < info.offset < toc):
+                report.add_error(info.offset, 'Section offset out of order: ' + repr(section_id))
+                continue
+            last_offset = info.offset
+
+            self.fp.seek(info.offset, io.SEEK_SET)
+            c_id = self.read_uint32()
+            endpos = self.read_uint32()
+            if c_id != ChunkId.MAJOR_SECTION or not (info.offset < endpos <= toc):
+                report.add_error(info.offset, 'Broken section preamble: ' + repr(section_id))
+
+    def scan_value(self, report, endpos):
+        start = self.fp.tell()
+        if endpos > self.fsize:
+            report.truncated = True
+        end = endpos if start < endpos <= self.fsize else self.fsize
+        report.last_good_offset = start
+
+        if len(self.sweep_vars) == 0:
+            report.npoints = 0
+            return
+        elif len(self.sweep_vars) != 1:
+            raise PSFReaderError('Not supported file format: Sweep variables is more than one.')
+
+        report.npoints = self.properties['PSF sweep points'].value
+        if 'PSF window size' in self.properties:
+            win_size = self.properties['PSF window size'].value
+        else:
+            win_size = 0
+
+        with mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if win_size > 0:
+                self.scan_value_win(buf, report, start, end, win_size)
+            else:
+                self.scan_value_non_win(buf, report, start, end)
+
+    def scan_value_win(self, buf, report, pos, end, win_size):
+        sweep_type = self.types[self.sweep_vars[0].type_id].data_type
+        sweep_size = typeid_to_size(sweep_type)
+        trace_size = sum(x.data_size(self) or 0 for x in self.traces)
+        nvars = len(self.trace_to_signal_names())
+
+        def block_length(p):
+            '''ブロック全体の長さとサンプル数．ブロックでなければNone'''
+            if p + 8 > end:
+                return None
+            (block_id, size) = struct.unpack_from('>II', buf, p)
+            if block_id == ElementId.DATA:
+                size &= 0x0000ffff
+                if not (0 < size * sweep_size <= win_size):
+                    return None
+                skip_size = win_size - sweep_size * size
+                return (8 + size * (sweep_size + trace_size) + nvars * skip_size, size)
+            elif block_id == ElementId.ZEROPAD:
+                return (8 + size, 0)
+            else:
+                return None
+
+        def is_block(p):
+            block = block_length(p)
+            if block is None or p + block[0] > end:
+                return False
+            nxt = p + block[0]
+            return nxt + 4 > end or struct.unpack_from('>I', buf, nxt)[0] in (ElementId.DATA, ElementId.ZEROPAD)
+
+        heads = [struct.pack('>I', ElementId.DATA), struct.pack('>I', ElementId.ZEROPAD)]
+        while report.scanned_points < report.npoints:
+            if pos + 8 > end:
+                report.set_truncated(pos, end)
+                break
+
+            block = block_length(pos)
+            if block is None:
+                nxt = self.find_next_block(buf, pos + 4, end, heads, is_block)
+                report.add_corrupt_region(pos, end if nxt is None else nxt)
+                if nxt is None:
+                    break
+                pos = nxt
+                continue
+
+            (length, size) = block
+            if pos + length > end:
+                report.set_truncated(pos, end)
+                break
+
+            if size > 0 and sweep_type == TypeId.DOUBLE:
+                first = struct.unpack_from('>d', buf, pos + 8)[0]
+                last = struct.unpack_from('>d', buf, pos + 8 + sweep_size * (size - 1))[0]
+                report.add_sweep_range(first, last)
+            pos += length
+            report.add_points(size, pos)
+
+    def scan_value_non_win(self, buf, report, pos, end):
+        sweep_var = self.sweep_vars[0]
+        sweep_type = self.types[sweep_var.type_id].data_type
+        sweep_size = typeid_to_size(sweep_type)
+        traces = {x.id: x for x in self.traces}
+        sizes = {x.id: x.data_size(self) for x in self.traces}
+
+        def string_length(p):
+            if p + 4 > end:
+                return end - p + 1
+            length = struct.unpack_from('>I', buf, p)[0]
+            return 4 + ((length + 3) & ~0x03)
+
+        def record_length(p):
+            '''レコード全体の長さとサンプル数．レコードでなければNone'''
+            if p + 8 > end:
+                return None
+            (elemid, var_id) = struct.unpack_from('>II', buf, p)
+            if elemid == ElementId.DATA and var_id == sweep_var.id:
+                return (8 + sweep_size, 1)
+            elif (elemid == ElementId.GROUP or elemid == ElementId.DATA) and var_id in sizes:
+                if sizes[var_id] is not None:
+                    return (8 + sizes[var_id], 0)
+                # 文字列を含む可変長のレコード
+                trace = traces[var_id]
+                length = 8
+                for v in (trace.vars if trace.is_group else [trace]):
+                    size = v.data_size(self)
+                    length += string_length(p + length) if size is None else size
+                return (length, 0)
+            else:
+                return None
+
+        def is_record(p):
+            record = record_length(p)
+            if record is None or p + record[0] > end:
+                return False
+            nxt = p + record[0]
+            return nxt + 8 > end or record_length(nxt) is not None
+
+        heads = [struct.pack('>II', ElementId.DATA, sweep_var.id)]
+        fixed = None not in sizes.values() and all(x % 4 == 0 for x in sizes.values())
+        chunk = 1 << 14
+        while pos < end:
+            if pos + 8 > end:
+                report.set_truncated(pos, end)
+                break
+
+            if fixed:
+                # 固定長のレコードが続く間はまとめて検査する．
+                # 次に読む語数は直前に受け付けた長さから決める
+                (nxt, consumed) = self.scan_records_fixed(buf, report, pos, end, sizes, sweep_var.id,
+                                                          sweep_size, sweep_type, chunk)
+                chunk = min(max(2 * consumed, 1 << 14), 1 << 22)
+                if nxt > pos:
+                    pos = nxt
+                    continue
+
+            record = record_length(pos)
+            if record is None:
+                # 通常はここで値の終わり
+                nxt = self.find_next_block(buf, pos + 4, end, heads, is_record)
+                if nxt is None:
+                    break
+                report.add_corrupt_region(pos, nxt)
+                pos = nxt
+                continue
+
+            (length, size) = record
+            if pos + length > end:
+                report.set_truncated(pos, end)
+                break
+
+            if size > 0 and sweep_type == TypeId.DOUBLE:
+                x = struct.unpack_from('>d', buf, pos + 8)[0]
+                report.add_sweep_range(x, x)
+            pos += length
+            report.add_points(size, pos)
+
+    def scan_records_fixed(self, buf, report, pos, end, sizes, sweep_id, sweep_size, sweep_type, chunk):
+        '''
+        固定長のレコードのみのファイルで，posから連続するレコードをまとめて検査する
+
+        chunk語分をコピーせずに語の配列として読み，ヘッダに見える位置を候補とする．
+        各候補の長さから求めた次の位置が次の候補と一致する間をレコードの並びとして受け付ける．
+        トレースが一部の点にしか書かれていなくても並びの形は問わない．
+        検査を終えた位置と，受け付けた語数を返す．
+        '''
+        count = min(chunk, (end - pos) // 4)
+        if count < 2:
+            return (pos, 0)
+
+        words = np.frombuffer(buf, dtype='>u4', count=count, offset=pos)
+        # 比較はバイト順を入れ替えずに行う
+        raw = words.view('=u4')
+        try:
+            (data, group) = np.array([ElementId.DATA, ElementId.GROUP], dtype='>u4').view('=u4')
+            heads = np.flatnonzero((raw[:-1] == data) | (raw[:-1] == group))
+            elemids = words[heads].astype(np.int64)
+            var_ids = words[heads + 1].astype(np.int64)
+        finally:
+            # mmapを閉じられるよう，バッファを参照する配列を残さない
+            del words, raw
+
+        ids = np.array(sorted(sizes), dtype=np.int64)
+        lengths = np.array([2 + sizes[x] // 4 for x in sorted(sizes)], dtype=np.int64)
+        idx = np.minimum(np.searchsorted(ids, var_ids), len(ids) - 1)
+        is_sweep = (elemids == ElementId.DATA) & (var_ids == sweep_id)
+        is_trace = ~is_sweep & (ids[idx] == var_ids)
+        length = np.where(is_sweep, 2 + sweep_size // 4, np.where(is_trace, lengths[idx], 0))
+
+        found = length > 0
+        heads = heads[found]
+        length = length[found]
+        is_sweep = is_sweep[found]
+        if len(heads) == 0 or heads[0] != 0:
+            return (pos, 0)
+
+        # 次の位置が次の候補と一致しなくなる所までがレコードの並び
+        nxt = heads + length
+        linked = nxt[:-1] == heads[1:]
+        m = len(heads) if linked.all() else int(np.argmin(linked)) + 1
+        if nxt[m - 1] > count:
+            m -= 1
+        if m == 0:
+            return (pos, 0)
+
+        points = np.flatnonzero(is_sweep[:m])
+        if len(points) > 0 and sweep_type == TypeId.DOUBLE:
+            first = struct.unpack_from('>d', buf, pos + 4 * int(heads[points[0]]) + 8)[0]
+            last = struct.unpack_from('>d', buf, pos + 4 * int(heads[points[-1]]) + 8)[0]
+            report.add_sweep_range(first, last)
+        consumed = int(nxt[m - 1])
+        report.add_points(len(points), pos + 4 * consumed)
+        return (pos + 4 * consumed, consumed)
+
+    def find_next_block(self, buf, pos, end, heads, is_valid):
+        '''
+        破損箇所より後ろで，次に妥当なブロック/レコードの先頭を探す
+        '''
+        pos = (pos + 3) & ~0x03
+        while pos < end:
+            found = [x for x in (buf.find(h, pos, end) for h in heads) if x >= 0]
+            if not found:
+                return None
+            p = min(found)
+            if p % 4 == 0 and is_valid(p):
+                return p
+            pos = p + 1
+        return None
 
     def array_list_from_trace(self, npoints, trace):
         return [(x, x.to_array(npoints, self)) for x in trace]
 
-    def array_list_from_trace_group(self, npoints, trace):
-        return {x.id: (x, x.to_array_group(npoints, self)) for x in trace}
+    def array_list_from_trace_group(self, npoints, trace, events=False):
+        return {x.id: (x, x.to_array_group(npoints, self, events)) for x in trace}
 
     def check_section_end(self, endpos):
         self.fp.seek(endpos, io.SEEK_SET)
@@ -387,10 +830,12 @@ class PSFFile:
     def flatten_value_group(self, value_map, sweep_data):
         arrays = dict()
         sweeps = dict()
+        valids = dict()
+        events = dict()
         for (v, a) in value_map.values():
-            v.flatten_value_group(a, arrays, sweeps, sweep_data)
+            v.flatten_value_group(a, arrays, sweeps, sweep_data, valids, events)
         variables = self.trace_to_signal_names()
-        return variables, arrays, sweeps
+        return variables, arrays, sweeps, valids, events
 
     def list_to_map(self, lst):
         return {v.name: a for (v, a) in lst}
@@ -407,9 +852,66 @@ class PSFReader:
     Parameter-Storage Format Reader for python.
     '''
 
-    def __init__(self, filename, header_only=False):
-        self.psf = PSFFile(filename)
-        self.psf.read_file(header_only=header_only)
+    def __init__(self, filename, header_only=False, cache=None):
+        '''cache: a SignalCache shared between readers, or True for the process-wide one
+
+        Signals read through a cache are read-only arrays shared by all the readers.'''
+        if cache is True:
+            cache = shared_cache()
+        self.cache = cache
+        self.decoded = None
+
+        if cache is None:
+            self.psf = PSFFile(filename)
+            self.psf.read_file(header_only=header_only)
+        else:
+            key = cache.file_key(filename)
+            psf = cache.get(key + (None,))
+            if psf is None or (psf.header_only and not header_only):
+                (psf, self.decoded) = self.decode_to_cache(filename, key, header_only)
+            self.psf = psf
+
+    def decode_to_cache(self, filename, key, header_only=False):
+        '''Decode the file and store its signals and header into the cache
+
+        The cached header does not keep the signal arrays, they are looked up by get_signal().
+        Return the header and a dictionary of the decoded signals.'''
+        psf = PSFFile(filename)
+        try:
+            psf.read_file(header_only=header_only)
+        finally:
+            psf.close()
+        psf.cache_key = key
+        psf.header_only = header_only
+
+        arrays = dict()
+        nbytes = 0
+        if len(psf.sweep_vars) > 0 and psf.value is not None:
+            arrays = psf.value
+            for (name, a) in arrays.items():
+                a.flags.writeable = False
+                self.cache.put(key + (name,), a, a.nbytes)
+            psf.value = None
+            psf.variables = [(v, None) for (v, _) in psf.variables]
+            shared = list()
+            if psf.sweep_value is not None:
+                shared.append(psf.sweep_value)
+            if psf.sweep_value_w_var is not None:
+                shared.extend(psf.sweep_value_w_var.values())
+            if psf.valid is not None:
+                shared.extend(psf.valid.values())
+            if psf.events is not None:
+                for e in psf.events.values():
+                    shared.extend([e.times, e.states])
+            for a in shared:
+                a.flags.writeable = False
+                nbytes += a.nbytes
+        elif psf.value is not None:
+            # スイープのないファイルの値はヘッダと一緒に保持する
+            nbytes += sum(np.asarray(x).nbytes for x in psf.value.values())
+
+        self.cache.put(key + (None,), psf, nbytes)
+        return psf, arrays
 
     def get_header_properties(self):
         '''Return a dictionary of properties'''
@@ -477,13 +979,122 @@ class PSFReader:
 
     def get_signal(self, name):
         '''Return the signal value and sweep value(scalar or vector)'''
-        if name in self.psf.value:
+        if self.psf.events is not None and name in self.psf.events:
+            return self.expand_events(name)
+        elif self.cache is not None and self.psf.value is None:
+            return self.get_cached_signal(name)
+        elif name in self.psf.value:
             return self.psf.value[name]
         else:
             return None
 
+    def get_cached_signal(self, name):
+        if self.decoded is not None and name in self.decoded:
+            # このリーダで読み込んだ信号はキャッシュから追い出されていても保持している
+            return self.decoded[name]
+        a = self.cache.get(self.psf.cache_key + (name,))
+        if a is not None:
+            return a
+        if not self.psf.header_only and name not in {v.name for (v, _) in self.psf.trace_to_signal_names()}:
+            return None
+
+        # 追い出されたか，ヘッダのみ読み込んだ場合は全体を読み直す
+        (self.psf, self.decoded) = self.decode_to_cache(self.psf.filename, self.psf.cache_key)
+        if self.psf.value is not None:
+            # スイープのないファイルの値はヘッダに含まれる
+            return self.psf.value.get(name)
+        elif self.psf.events is not None and name in self.psf.events:
+            return self.expand_events(name)
+        return self.decoded.get(name)
+
+    def expand_events(self, name):
+        '''文字列の信号の変化点から，各スイープ値で保持されている状態名の配列を作る'''
+        events = self.psf.events[name]
+        # 最初の変化点より前の状態コード-1は末尾の空文字列になる
+        names = np.array(events.state_names + [''])
+        return names[events.to_dense(self.psf.sweep_value)]
+
+    def get_events(self, name):
+        '''Return the EventSignal (change points and state codes) of an integer or string signal
+
+        String signals of non-windowed files are decoded as change points when the file is read,
+        and that EventSignal is returned. For the other signals, it is built from the samples
+        of the signal on each call, keeping only the samples where the value changes.'''
+        if not is_state_type(self.get_signal_types(name)):
+            return None
+        if self.psf.events is not None and name in self.psf.events:
+            return self.psf.events[name]
+        # ヘッダのみ読み込んでいた場合は，ここで変化点も読み込まれる
+        values = self.get_signal(name)
+        if self.psf.events is not None and name in self.psf.events:
+            return self.psf.events[name]
+        sweep = self.get_sweep_values_with_var(name)
+        if values is None or sweep is None:
+            return None
+        return EventSignal.from_samples(sweep, values)
+
+    def get_dense_signal(self, name, sweep=None):
+        '''Return the states of an integer or string signal held at each sweep value
+
+        By default, the sweep values of this file are used.'''
+        events = self.get_events(name)
+        if events is None:
+            return None
+        if sweep is None:
+            sweep = self.psf.sweep_value
+        return events.to_dense(sweep)
+
+    def resample(self, names=None, sweep=None, method='linear'):
+        '''Return signals resampled onto a common sweep as a 2-D array
+
+        names: signal names (default: all signals), one column per signal
+        sweep: None for the sweep values of this file, an int for a uniform grid
+               of that many points over the sweep range, or an array of sweep values
+        method: 'linear' or 'hold'. Integer and string signals are always resampled
+                with 'hold', string signals as the codes of EventSignal.state_names.
+        Points where a signal has no sample around (e.g. before its first sample
+        in a non-windowed file) are NaN.
+        Return a tuple of the sweep values and the array of shape (len(sweep), len(names))'''
+        if len(self.psf.sweep_vars) == 0 or self.psf.sweep_value is None:
+            raise PSFReaderError('This file has no sweep to resample on.')
+        if names is None:
+            names = self.get_signal_names()
+
+        if sweep is None:
+            sweep = self.psf.sweep_value
+        elif isinstance(sweep, (int, np.integer)):
+            sweep = resample.uniform_grid(self.psf.sweep_value, sweep)
+
+        signals = list()
+        methods = list()
+        for name in names:
+            values = None
+            if self.psf.events is None or name not in self.psf.events:
+                # ヘッダのみ読み込んでいた場合は，ここで変化点も読み込まれる
+                values = self.get_signal(name)
+            if self.psf.events is not None and name in self.psf.events:
+                # 状態コードの配列にし，最初の変化点より前は無効とする
+                codes = self.psf.events[name].to_dense(self.psf.sweep_value)
+                signals.append((codes[codes >= 0], codes >= 0))
+                methods.append('hold')
+                continue
+            if values is None:
+                raise PSFReaderError('No such signal: ' + repr(name))
+            valid = self.psf.valid[name] if self.psf.valid is not None else None
+            if is_state_type(self.get_signal_types(name)):
+                # 状態の間を補間しない
+                methods.append('hold')
+            else:
+                methods.append(method)
+            signals.append((values, valid))
+
+        return sweep, resample.resample(self.psf.sweep_value, signals, sweep, methods)
+
     def get_sweep_values_with_var(self, name):
-        if self.psf.sweep_value_w_var is not None:
+        if self.psf.events is not None and name in self.psf.events:
+            # 変化点から展開した値は全てのスイープ値にある
+            return self.psf.sweep_value
+        elif self.psf.sweep_value_w_var is not None:
             if name in self.psf.sweep_value_w_var:
                 return self.psf.sweep_value_w_var[name]
             else:
@@ -499,3 +1110,16 @@ class PSFReader:
 
     def is_wellformed(self):
         return self.psf.has_footer and self.psf.completed
+
+
+def validate(filename):
+    '''Check the structure of a PSF file without decoding the signal values
+
+    Return a ValidationReport (completeness, number of valid points and corrupt regions)'''
+    psf = PSFFile(filename)
+    report = ValidationReport(filename, psf.fsize, psf.has_footer)
+    try:
+        psf.validate(report)
+    finally:
+        psf.close()
+    return report
@@ -0,0 +1,92 @@
+import os
+import threading
+import collections
+
+
+class SignalCache:
+    '''
+    Process-wide cache of parsed headers and decoded signals.
+
+    Entries are keyed by (path, size, mtime) of the file followed by the signal
+    name (None for the header), so a rewritten file never hits stale entries.
+    The total size is kept under max_bytes by evicting the least recently used entries.
+    '''
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def file_key(filename):
+        '''Return (path, size, mtime) identifying the current contents of the file'''
+        st = os.stat(filename)
+        return (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            else:
+                self.misses += 1
+                return None
+
+    def put(self, key, value, nbytes):
+        '''Store a value. Values larger than the whole budget are not stored.'''
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return False
+
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self.evict(self.max_bytes)
+            return True
+
+    def evict(self, max_bytes):
+        with self.lock:
+            while self.nbytes > max_bytes and self.entries:
+                (_, (_, nbytes)) = self.entries.popitem(last=False)
+                self.nbytes -= nbytes
+                self.evictions += 1
+
+    def resize(self, max_bytes):
+        '''Change the memory budget, evicting entries if needed'''
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict(max_bytes)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        '''Return a dictionary of hit/miss statistics and memory usage'''
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+shared = None
+shared_lock = threading.Lock()
+
+
+def shared_cache(max_bytes=None):
+    '''Return the process-wide SignalCache, creating it on first use
+
+    If max_bytes is given, the budget of the shared cache is changed.'''
+    global shared
+    with shared_lock:
+        if shared is None:
+            shared = SignalCache() if max_bytes is None else SignalCache(max_bytes)
+        elif max_bytes is not None:
+            shared.resize(max_bytes)
+        return shared
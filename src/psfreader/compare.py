@@ -0,0 +1,291 @@
+import sys
+import argparse
+import numpy as np
+from psfreader import PSFFile
+
+
+class SignalDiff:
+    def __init__(self, name):
+        self.name = name
+        self.npoints = 0
+        self.nfailed = 0
+        self.nmissing = 0  # goldenのスイープ範囲外にあるサンプル数
+        self.nunmatched = 0  # 比較対象の終わりより後ろにあるgoldenのサンプル数
+        self.max_abs_error = 0.0
+        self.max_rel_error = 0.0
+        self.sweep_at_max = None
+        self.first_failure = None
+
+    def __repr__(self):
+        return ('SignalDiff(name: ' + self.name + ', points: ' + repr(self.npoints) + ', failed: ' + repr(self.nfailed)
+                + ', max_abs_error: ' + repr(self.max_abs_error) + ', max_rel_error: ' + repr(self.max_rel_error) + ')')
+
+    def passed(self):
+        return self.nfailed == 0 and self.nmissing == 0 and self.nunmatched == 0
+
+    def add_chunk(self, x, y, gx, gy, abstol, reltol, direction):
+        '''gx, gyを線形補間したgoldenの値とx, yを比較する'''
+        self.npoints += len(x)
+        if len(gx) == 0:
+            self.add_missing(x * direction)
+            return
+
+        inside = (x >= gx[0]) & (x <= gx[-1])
+        if not inside.all():
+            self.add_missing(x[~inside] * direction)
+            x = x[inside]
+            y = y[inside]
+            if len(x) == 0:
+                return
+
+        if gy.dtype.kind in ('U', 'S'):
+            # 文字列の値は，その点で保持されているgoldenの値と一致するかのみ比較する
+            ref = gy[np.searchsorted(gx, x, side='right') - 1]
+            err = (y != ref).astype(float)
+            mag = np.ones(len(x))
+            failed = err > 0
+        else:
+            if np.iscomplexobj(gy):
+                ref = np.interp(x, gx, gy.real) + 1j * np.interp(x, gx, gy.imag)
+            else:
+                ref = np.interp(x, gx, gy)
+            err = np.abs(y - ref)
+            mag = np.abs(ref)
+            failed = err > abstol + reltol * mag
+
+        nfailed = np.count_nonzero(failed)
+        if nfailed > 0:
+            if self.first_failure is None:
+                self.first_failure = x[np.argmax(failed)] * direction
+            self.nfailed += nfailed
+
+        i = np.argmax(err)
+        if err[i] > self.max_abs_error:
+            self.max_abs_error = float(err[i])
+            self.sweep_at_max = x[i] * direction
+        nonzero = mag > 0
+        if nonzero.any():
+            self.max_rel_error = max(self.max_rel_error, float(np.max(err[nonzero] / mag[nonzero])))
+
+    def add_missing(self, x):
+        self.nmissing += len(x)
+        if self.first_failure is None:
+            self.first_failure = x[0]
+
+
+class CompareReport:
+    def __init__(self, golden, target):
+        self.golden = golden
+        self.target = target
+        self.signals = dict()
+        self.missing_signals = list()  # goldenにしかない信号
+        self.extra_signals = list()  # 比較対象にしかない信号
+        self.golden_completed = False
+        self.target_completed = False
+        self.stopped = False
+
+    def __repr__(self):
+        return ('CompareReport(golden: ' + repr(self.golden) + ', target: ' + repr(self.target) + ', passed: '
+                + repr(self.passed()) + ', failures: ' + repr([d.name for d in self.failures()]) + ')')
+
+    def passed(self):
+        return (not self.missing_signals and not self.stopped and self.golden_completed and self.target_completed
+                and all(d.passed() for d in self.signals.values()))
+
+    def failures(self):
+        return [d for d in self.signals.values() if not d.passed()]
+
+
+class SweepStream:
+    '''
+    PSFファイルを少しずつ読み込み，信号ごとに(スイープ値, 値)をバッファする
+
+    スイープ値が減少する場合は符号を反転し，常に増加するものとして扱う
+    '''
+
+    def __init__(self, filename, chunk_points):
+        self.psf = PSFFile(filename)
+        self.chunks = self.psf.iter_value(chunk_points)
+        self.direction = None
+        self.names = None
+        self.buffers = dict()
+        self.last = None  # 読み込んだ最後のスイープ値
+        self.done = False
+
+    def close(self):
+        self.psf.close()
+
+    def signal_names(self):
+        if self.buffers:
+            return list(self.buffers)
+        return [v.name for (v, _) in self.psf.trace_to_signal_names()]
+
+    def keep(self, names):
+        self.names = set(names)
+        self.buffers = {n: self.buffers[n] for n in names if n in self.buffers}
+
+    def pull(self):
+        if self.done:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            return False
+
+        (sweep, values, valid) = chunk
+        if sweep is None:
+            sweep = np.zeros(1)
+        if self.direction is None:
+            self.direction = -1.0 if len(sweep) > 1 and sweep[-1] < sweep[0] else 1.0
+        x = sweep.real * self.direction
+        if len(x) > 0:
+            self.last = x[-1]
+
+        for (name, y) in values.items():
+            if self.names is not None and name not in self.names:
+                continue
+            if valid is not None:
+                xs = x[valid[name]]
+                ys = y[valid[name]]
+            else:
+                xs = x
+                ys = y
+            if name in self.buffers:
+                (bx, by) = self.buffers[name]
+                self.buffers[name] = (np.concatenate([bx, xs]), np.concatenate([by, ys]))
+            else:
+                self.buffers[name] = (xs, ys)
+        return True
+
+    def take(self, name):
+        '''バッファされたサンプルをすべて取り出す'''
+        if name not in self.buffers:
+            return np.empty(0), np.empty(0)
+        return self.buffers.pop(name)
+
+    def fill(self, name, x):
+        '''
+        サンプルがxを超えるまで読み進める
+
+        スイープ値がxを超えてもサンプルがなければ，一部の点にしか書かれない信号のために
+        1チャンクだけ先読みして止める．途中で終わった信号のために他の信号のバッファが
+        ファイルの終わりまで伸びることはない
+        '''
+        def reached():
+            return name in self.buffers and len(self.buffers[name][0]) > 0 and self.buffers[name][0][-1] >= x
+
+        while not reached() and (self.last is None or self.last < x):
+            if not self.pull():
+                return
+        if not reached():
+            self.pull()
+
+    def trim(self, name, x):
+        '''x以降の補間に必要なサンプルのみを残す'''
+        if name in self.buffers:
+            (bx, by) = self.buffers[name]
+            i = max(np.searchsorted(bx, x, side='right') - 1, 0)
+            self.buffers[name] = (bx[i:], by[i:])
+
+
+def compare_files(golden, target, signals=None, abstol=1e-12, reltol=1e-6, stop_on_failure=False,
+                  chunk_points=8192):
+    '''Compare the signals of a PSF file with a golden PSF file
+
+    Signals are matched by name and aligned by their sweep values, linearly
+    interpolating the golden signal when the sweep points differ. Both files are
+    read chunk by chunk, so the memory usage is bounded by chunk_points.
+    A point fails if |target - golden| > abstol + reltol * |golden|.
+    String signals fail where they differ from the golden value held at that point.
+    Return a CompareReport.'''
+    report = CompareReport(golden, target)
+    g = SweepStream(golden, chunk_points)
+    t = SweepStream(target, chunk_points)
+    try:
+        g.pull()
+        t.pull()
+
+        gnames = g.signal_names()
+        tnames = t.signal_names()
+        if signals is not None:
+            wanted = set(signals)
+            gnames = [n for n in gnames if n in wanted]
+            tnames = [n for n in tnames if n in wanted]
+        names = [n for n in gnames if n in tnames]
+        report.missing_signals = [n for n in (gnames if signals is None else signals) if n not in names]
+        report.extra_signals = [n for n in tnames if n not in gnames]
+        g.keep(names)
+        t.keep(names)
+        for n in names:
+            report.signals[n] = SignalDiff(n)
+
+        last = dict()
+        while True:
+            for n in names:
+                (x, y) = t.take(n)
+                if len(x) == 0:
+                    continue
+                g.fill(n, x[-1])
+                (gx, gy) = g.buffers.get(n, (np.empty(0), np.empty(0)))
+                report.signals[n].add_chunk(x, y, gx, gy, abstol, reltol, t.direction)
+                g.trim(n, x[-1])
+                last[n] = x[-1]
+
+            if stop_on_failure and report.failures():
+                report.stopped = True
+                break
+            if not t.pull():
+                break
+
+        if not report.stopped:
+            # 比較対象より後ろに残っているgoldenのサンプル
+            while True:
+                for n in names:
+                    (gx, _) = g.take(n)
+                    report.signals[n].nunmatched += len(gx) if n not in last else np.count_nonzero(gx > last[n])
+                if not g.pull():
+                    break
+
+        report.golden_completed = g.psf.has_footer and g.psf.completed
+        report.target_completed = t.psf.has_footer and t.psf.completed
+    finally:
+        g.close()
+        t.close()
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare a PSF file with a golden PSF file')
+    parser.add_argument('golden')
+    parser.add_argument('target')
+    parser.add_argument('--abstol', type=float, default=1e-12)
+    parser.add_argument('--reltol', type=float, default=1e-6)
+    parser.add_argument('--signal', action='append', help='signal name to compare (repeatable, default: all)')
+    parser.add_argument('--stop-on-failure', action='store_true')
+    opt = parser.parse_args(argv)
+
+    report = compare_files(opt.golden, opt.target, signals=opt.signal, abstol=opt.abstol, reltol=opt.reltol,
+                           stop_on_failure=opt.stop_on_failure)
+
+    print('signal\tpoints\tfailed\tmax_abs_error\tmax_rel_error\tsweep_at_max')
+    for d in report.signals.values():
+        print('{}\t{}\t{}\t{:E}\t{:E}\t{}'.format(d.name, d.npoints, d.nfailed + d.nmissing + d.nunmatched,
+                                                  d.max_abs_error, d.max_rel_error, d.sweep_at_max))
+    for n in report.missing_signals:
+        print('missing signal: ' + n)
+    for n in report.extra_signals:
+        print('extra signal: ' + n)
+    if not report.golden_completed:
+        print('golden file is broken or incompleted')
+    if not report.target_completed:
+        print('target file is broken or incompleted')
+    if report.stopped:
+        print('stopped at the first failure')
+
+    print('PASS' if report.passed() else 'FAIL')
+    return 0 if report.passed() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
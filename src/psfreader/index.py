@@ -0,0 +1,265 @@
+import os
+import struct
+import fnmatch
+import functools
+import sqlite3
+import concurrent.futures
+from psfreader import PSFFile
+from psfreader.psfdata import *
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    analysis_type TEXT,
+    sweep_name TEXT,
+    sweep_units TEXT,
+    sweep_start REAL,
+    sweep_stop REAL,
+    npoints INTEGER,
+    read_points INTEGER,
+    wellformed INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS properties (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value
+);
+CREATE TABLE IF NOT EXISTS signals (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    units TEXT,
+    type TEXT
+);
+CREATE INDEX IF NOT EXISTS properties_path ON properties(path);
+CREATE INDEX IF NOT EXISTS signals_path ON signals(path);
+CREATE INDEX IF NOT EXISTS signals_name ON signals(name);
+'''
+
+
+def read_index_entry(path, scan=False):
+    '''Read the metadata of a PSF file for the index
+
+    Only the sections before the values are decoded, except the values of
+    non-swept (e.g. DC) files, which are the only place of their signal names.
+    If scan is True, the value section is also walked by PSFFile.validate()
+    for the number of readable points, the sweep range and the well-formedness.
+    Otherwise a file is taken as well-formed if it has the footer.
+    Runs in a worker process, so the result is a plain dictionary.'''
+    st = os.stat(path)
+    entry = {'path': path, 'mtime': st.st_mtime, 'size': st.st_size, 'error': None}
+
+    try:
+        psf = PSFFile(path)
+    except OSError as e:
+        entry['error'] = repr(e)
+        return entry
+
+    report = ValidationReport(path, psf.fsize, psf.has_footer)
+    try:
+        if scan:
+            psf.validate(report)
+        if not report.errors:
+            endpos = psf.seek_value_section()
+            if endpos is not None and len(psf.sweep_vars) == 0:
+                psf.read_non_sweep_value()
+    except (struct.error, KeyError, ValueError) as e:
+        report.add_error(psf.fp.tell(), repr(e))
+    finally:
+        psf.close()
+
+    if report.errors and not psf.properties:
+        # PSFでないファイル
+        entry['error'] = report.errors[0][1]
+        return entry
+
+    properties = {key: psf.properties[key].value for key in psf.properties}
+    entry['properties'] = properties
+    entry['analysis_type'] = properties.get('analysis type')
+    entry['npoints'] = properties.get('PSF sweep points')
+    if scan:
+        entry['read_points'] = report.valid_points
+        entry['wellformed'] = report.is_complete()
+    else:
+        entry['read_points'] = None
+        entry['wellformed'] = psf.has_footer and not report.errors
+    entry['sweep_start'] = report.sweep_start
+    entry['sweep_stop'] = report.sweep_stop
+
+    if len(psf.sweep_vars) > 0:
+        sweep_var = psf.sweep_vars[0]
+        entry['sweep_name'] = sweep_var.name
+        entry['sweep_units'] = sweep_var.prop['units'].value if 'units' in sweep_var.prop else None
+    else:
+        entry['sweep_name'] = None
+        entry['sweep_units'] = None
+
+    if psf.variables is not None:
+        variables = [v for (v, _) in psf.variables]
+    else:
+        variables = [v for (v, _) in psf.trace_to_signal_names()]
+
+    signals = list()
+    for v in variables:
+        units = None
+        data_type = None
+        if v.type_id in psf.types:
+            psf_type = psf.types[v.type_id]
+            if 'units' in psf_type.prop:
+                units = psf_type.prop['units'].value
+            if psf_type.data_type in set(TypeId):
+                data_type = TypeId(psf_type.data_type).name
+        signals.append((v.name, units, data_type))
+    entry['signals'] = signals
+
+    return entry
+
+
+class PSFIndex:
+    '''
+    Metadata index of PSF files stored in a local SQLite database.
+    '''
+
+    def __init__(self, dbfile):
+        self.db = sqlite3.connect(dbfile)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, directories, pattern=None, workers=None, scan=False):
+        '''Scan directories and (re)index files whose size or mtime changed
+
+        pattern is a glob for file names (e.g. '*.tran'), all files by default.
+        Files are read in parallel by `workers` processes (1 to read in this process).
+        Only the headers are read unless scan is True, which also walks the values for
+        the number of readable points and the sweep range (see read_index_entry()).
+        Files indexed without the scan are re-read when scan is True.
+        Return a tuple of the number of updated files and removed files.'''
+        if isinstance(directories, str):
+            directories = [directories]
+
+        known = {path: (mtime, size) for (path, mtime, size) in self.db.execute('SELECT path, mtime, size FROM files')}
+        unscanned = set()
+        if scan:
+            unscanned = {path for (path,) in self.db.execute('SELECT path FROM files WHERE read_points IS NULL '
+                                                             'AND error IS NULL')}
+        found = set()
+        targets = list()
+        for directory in directories:
+            for (root, _, files) in os.walk(os.path.abspath(directory)):
+                for name in files:
+                    if pattern is not None and not fnmatch.fnmatch(name, pattern):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.add(path)
+                    if known.get(path) != (st.st_mtime, st.st_size) or path in unscanned:
+                        targets.append(path)
+
+        removed = list()
+        for directory in directories:
+            prefix = os.path.join(os.path.abspath(directory), '')
+            removed.extend(p for p in known if p.startswith(prefix) and p not in found)
+
+        read_entry = functools.partial(read_index_entry, scan=scan)
+        with self.db:
+            self.db.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in removed])
+
+            if workers == 1 or len(targets) <= 1:
+                for entry in map(read_entry, targets):
+                    self.store_entry(entry)
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                    for entry in executor.map(read_entry, targets, chunksize=16):
+                        self.store_entry(entry)
+
+        return len(targets), len(removed)
+
+    def store_entry(self, entry):
+        path = entry['path']
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+        if entry['error'] is not None:
+            self.db.execute('INSERT INTO files (path, mtime, size, error) VALUES (?, ?, ?, ?)',
+                            (path, entry['mtime'], entry['size'], entry['error']))
+            return
+
+        self.db.execute('INSERT INTO files (path, mtime, size, analysis_type, sweep_name, sweep_units, sweep_start, '
+                        'sweep_stop, npoints, read_points, wellformed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, entry['mtime'], entry['size'], entry['analysis_type'], entry['sweep_name'],
+                         entry['sweep_units'], entry['sweep_start'], entry['sweep_stop'], entry['npoints'],
+                         entry['read_points'], int(entry['wellformed'])))
+        self.db.executemany('INSERT INTO properties (path, name, value) VALUES (?, ?, ?)',
+                            [(path, k, v) for (k, v) in entry['properties'].items()])
+        self.db.executemany('INSERT INTO signals (path, name, units, type) VALUES (?, ?, ?, ?)',
+                            [(path, n, u, t) for (n, u, t) in entry['signals']])
+
+    def query_filter(self, analysis_type=None, sweep_name=None, sweep_range=None, wellformed=None, properties=None):
+        conds = ['f.error IS NULL']
+        params = list()
+        if analysis_type is not None:
+            conds.append('f.analysis_type = ?')
+            params.append(analysis_type)
+        if sweep_name is not None:
+            conds.append('f.sweep_name = ?')
+            params.append(sweep_name)
+        if sweep_range is not None:
+            # 指定された範囲全体をスイープが含むファイル
+            conds.append('f.sweep_start <= ? AND f.sweep_stop >= ?')
+            params.extend([min(sweep_range), max(sweep_range)])
+        if wellformed is not None:
+            conds.append('f.wellformed = ?')
+            params.append(int(wellformed))
+        if properties is not None:
+            for (k, v) in properties.items():
+                conds.append('EXISTS (SELECT 1 FROM properties p WHERE p.path = f.path AND p.name = ? AND p.value = ?)')
+                params.extend([k, v])
+        return ' AND '.join(conds), params
+
+    def find_files(self, signal=None, **filters):
+        '''Return a list of indexed files matching the conditions
+
+        signal is a glob pattern of signal names (e.g. 'I0.net*').
+        filters: analysis_type, sweep_name, sweep_range=(start, stop), wellformed, properties={name: value}
+        sweep_range only matches files indexed with update(scan=True).'''
+        cond, params = self.query_filter(**filters)
+        if signal is not None:
+            cond += ' AND EXISTS (SELECT 1 FROM signals s WHERE s.path = f.path AND s.name GLOB ?)'
+            params.append(signal)
+        sql = 'SELECT f.path FROM files f WHERE ' + cond + ' ORDER BY f.path'
+        return [path for (path,) in self.db.execute(sql, params)]
+
+    def find_signals(self, signal, **filters):
+        '''Return a list of (path, signal name, units) of signals matching the glob pattern
+
+        The same filters as find_files() are available.'''
+        cond, params = self.query_filter(**filters)
+        sql = ('SELECT f.path, s.name, s.units FROM files f JOIN signals s ON s.path = f.path WHERE s.name GLOB ? AND '
+               + cond + ' ORDER BY f.path, s.rowid')
+        return list(self.db.execute(sql, [signal] + params))
+
+    def get_file_info(self, path):
+        '''Return a dictionary of the indexed metadata of a file, or None'''
+        cur = self.db.execute('SELECT * FROM files WHERE path = ?', (os.path.abspath(path),))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        info = {d[0]: x for (d, x) in zip(cur.description, row)}
+        info['wellformed'] = bool(info['wellformed'])
+        info['properties'] = dict(self.db.execute('SELECT name, value FROM properties WHERE path = ?', (info['path'],)))
+        info['signals'] = [name for (name,) in self.db.execute('SELECT name FROM signals WHERE path = ? ORDER BY rowid',
+                                                                 (info['path'],))]
+        return info
@@ -39,6 +39,27 @@ def typeid_to_size(t):
         raise ValueError('Cannot to be a element of array: Type ' + str(TypeId(t)))
 
 
+def typeid_to_file_dtype(t):
+    '''ファイル上の表現(ビッグエンディアン)のdtype
+
+    INT8もINT32と同じく4byteで格納されている'''
+    if t == TypeId.INT8:
+        return np.dtype('>i4')
+    elif t == TypeId.INT32:
+        return np.dtype('>i4')
+    elif t == TypeId.DOUBLE:
+        return np.dtype('>f8')
+    elif t == TypeId.COMPLEX_DOUBLE:
+        return np.dtype('>c16')
+    else:
+        raise ValueError('Cannot to be a element of array: Type ' + str(TypeId(t)))
+
+
+def is_state_type(t):
+    '''整数や文字列のように，離散的な状態を表す型'''
+    return t == TypeId.INT8 or t == TypeId.INT32 or t == TypeId.STRING
+
+
 class SectionId(IntEnum):
     HEADER = 0
     TYPE = 1
@@ -74,6 +95,138 @@ class SectionInfo:
         return 'SectionInfo(offset: ' + repr(self.offset) + ', size: ' + repr(self.size) + ')'
 
 
+class ValidationReport:
+    def __init__(self, filename, fsize, has_footer):
+        self.filename = filename
+        self.fsize = fsize
+        self.has_footer = has_footer
+        self.truncated = not has_footer
+        self.npoints = None
+        self.valid_points = 0  # 先頭から連続して読めるサンプル数
+        self.scanned_points = 0  # 破損箇所以降も含めて読めるサンプル数
+        self.last_good_offset = 0
+        self.sweep_start = None
+        self.sweep_stop = None
+        self.corrupt_regions = list()
+        self.errors = list()
+
+    def __repr__(self):
+        return ('ValidationReport(file: ' + repr(self.filename) + ', complete: ' + repr(self.is_complete())
+                + ', points: ' + repr(self.valid_points) + '/' + repr(self.npoints)
+                + ', corrupt_regions: ' + repr(self.corrupt_regions) + ', errors: ' + repr(self.errors) + ')')
+
+    def is_complete(self):
+        return self.has_footer and not self.truncated and not self.corrupt_regions and not self.errors
+
+    def add_points(self, npoints, offset):
+        self.scanned_points += npoints
+        if not self.corrupt_regions:
+            self.valid_points += npoints
+            self.last_good_offset = offset
+
+    def add_sweep_range(self, first, last):
+        '''先頭から連続して読める範囲のスイープ値の始点と終点を記録'''
+        if not self.corrupt_regions:
+            if self.sweep_start is None:
+                self.sweep_start = first
+            self.sweep_stop = last
+
+    def add_corrupt_region(self, start, end):
+        self.corrupt_regions.append((start, end))
+
+    def set_truncated(self, start, end):
+        self.truncated = True
+        if start < end:
+            self.add_corrupt_region(start, end)
+
+    def add_error(self, offset, message):
+        self.errors.append((offset, message))
+
+
+class EventSignal:
+    '''
+    Signal of discrete states stored as the sweep values where the state changes
+    and the state codes from there on.
+
+    For string states, state_names[code] is the name of the state (e.g. '0', '1', 'x', 'z').
+    '''
+
+    def __init__(self, times, states, state_names=None):
+        self.times = times
+        self.states = states
+        self.state_names = state_names
+
+    def __repr__(self):
+        return 'EventSignal(events: ' + repr(len(self.times)) + ', states: ' + repr(self.state_names) + ')'
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.states.nbytes
+
+    @staticmethod
+    def from_samples(sweep, values):
+        '''Build from the values at each sweep value, keeping only the points where the value changes'''
+        values = np.asarray(values)
+        if values.dtype.kind in ('U', 'S'):
+            (names, states) = np.unique(values, return_inverse=True)
+            states = states.astype(np.int32)
+            state_names = names.tolist()
+        else:
+            states = values
+            state_names = None
+        changed = np.ones(len(states), dtype=bool)
+        changed[1:] = states[1:] != states[:-1]
+        return EventSignal(np.asarray(sweep)[changed], states[changed], state_names)
+
+    def to_dense(self, sweep, initial=-1):
+        '''Return the states held at each sweep value
+
+        initial is the state code before the first event'''
+        if len(self.states) == 0:
+            return np.full(len(sweep), initial, dtype=self.states.dtype)
+        idx = np.searchsorted(self.times, sweep, side='right') - 1
+        dense = self.states[np.maximum(idx, 0)]
+        dense[idx < 0] = initial
+        return dense
+
+
+class EventArray:
+    '''
+    非ウィンドウ形式のファイル全体を読み込む間，文字列の信号の値が変わった点のみを記録する
+
+    点番号と状態コードを保持し，読み込み後にEventSignalに変換する
+    '''
+
+    def __init__(self):
+        self.points = list()
+        self.states = list()
+        self.codes = dict()  # 状態名 -> 読み込んだ順の状態コード
+
+    def append(self, i, value):
+        if i < 0:
+            return
+        code = self.codes.setdefault(value, len(self.codes))
+        if self.points and self.points[-1] == i:
+            # 同じ点で再び書かれた場合は後の値
+            self.points.pop()
+            self.states.pop()
+        if not self.states or self.states[-1] != code:
+            self.points.append(i)
+            self.states.append(code)
+
+    def to_event_signal(self, sweep_data):
+        '''状態コードを状態名の順に振り直し，変化点のスイープ値を求める'''
+        names = sorted(self.codes)
+        order = np.empty(len(names), dtype=np.int32)
+        order[[self.codes[x] for x in names]] = np.arange(len(names), dtype=np.int32)
+        times = sweep_data[np.asarray(self.points, dtype=np.intp)]
+        states = order[np.asarray(self.states, dtype=np.intp)]
+        return EventSignal(times, states, names)
+
+
 class PSF_Property:
     def __init__(self):
         self.name = ''
@@ -119,6 +272,38 @@ class PSF_Property:
 
         return properties
 
+    @staticmethod
+    def from_value(name, value):
+        p = PSF_Property()
+        p.name = name
+        p.value = value
+        if isinstance(value, str):
+            p.type = PropertyTypeId.STRING
+        elif isinstance(value, (int, np.integer)):
+            p.type = PropertyTypeId.INT
+        elif isinstance(value, (float, np.floating)):
+            p.type = PropertyTypeId.DOUBLE
+        else:
+            raise ValueError('Unsupported property value: ' + repr(value))
+        return p
+
+    def write(self, psfwriter):
+        psfwriter.write_uint32(self.type)
+        psfwriter.write_str(self.name)
+        if self.type == PropertyTypeId.STRING:
+            psfwriter.write_str(self.value)
+        elif self.type == PropertyTypeId.INT:
+            psfwriter.write_int32(self.value)
+        elif self.type == PropertyTypeId.DOUBLE:
+            psfwriter.write_double(self.value)
+        else:
+            raise ValueError('Unexpected Property type number: ' + str(self.type))
+
+    @staticmethod
+    def write_dictionary(psfwriter, properties):
+        for p in properties.values():
+            p.write(psfwriter)
+
 
 class PSF_Type:
     def __init__(self):
@@ -163,6 +348,20 @@ class PSF_Type:
             else:
                 break
 
+    def write(self, psfwriter):
+        psfwriter.write_uint32(ElementId.DATA)
+        psfwriter.write_uint32(self.id)
+        psfwriter.write_str(self.name)
+        psfwriter.write_uint32(self.arry_type)
+        psfwriter.write_uint32(self.data_type)
+
+        if self.data_type == TypeId.STRUCT:
+            for typedef in self.typelist:
+                psfwriter.write_uint32(TypeId.TUPLE)
+                typedef.write(psfwriter)
+
+        PSF_Property.write_dictionary(psfwriter, self.prop)
+
 
 class PSF_Variable:
     def __init__(self):
@@ -185,6 +384,13 @@ class PSF_Variable:
 
         return True
 
+    def write(self, psfwriter):
+        psfwriter.write_uint32(ElementId.DATA)
+        psfwriter.write_uint32(self.id)
+        psfwriter.write_str(self.name)
+        psfwriter.write_uint32(self.type_id)
+        PSF_Property.write_dictionary(psfwriter, self.prop)
+
     def __repr__(self):
         return 'Var(id: ' + repr(self.id) + ' name: ' + self.name + ', type_id:' + repr(self.type_id) + ', ' + repr(self.prop) + ')'
 
@@ -193,12 +399,21 @@ class PSF_Variable:
         dtype = typeid_to_dtype(psf_type)
         return np.empty(npoints, dtype=dtype)
 
-    def to_array_group(self, npoints, psffile):
+    def to_array_group(self, npoints, psffile, events=False):
+        '''events: 文字列の信号を値が変わった点のみのEventArrayとして読み込む'''
         psf_type = psffile.types[self.type_id].data_type
-        dtype = typeid_to_dtype(psf_type)
+        if psf_type == TypeId.STRING:
+            if events:
+                return EventArray()
+            dtype = object  # 読み込み後に文字列の配列に変換する
+        else:
+            dtype = typeid_to_dtype(psf_type)
         return (np.empty(npoints, dtype=dtype), np.zeros(npoints, dtype=bool))
 
     def read_data(self, array, i, psffile):
+        if isinstance(array, EventArray):
+            array.append(i, psffile.read_data(TypeId.STRING))
+            return
         data_array, data_valid = array
         data_array[i] = psffile.read_data(psffile.types[self.type_id].data_type)
         data_valid[i] = True
@@ -206,14 +421,28 @@ class PSF_Variable:
     def read_data_win(self, array, start, size, psffile):
         psffile.read_data_win(array, start, size, psffile.types[self.type_id].data_type)
 
+    def data_size(self, psffile):
+        '''値の大きさ(byte)．文字列のように可変長の場合はNone'''
+        psf_type = psffile.types[self.type_id].data_type
+        if psf_type == TypeId.STRING:
+            return None
+        return typeid_to_size(psf_type)
+
     def flatten_value(self, a, arrays):
         arrays[self.name] = a
         return [(self, a)]
 
-    def flatten_value_group(self, a, arrays, sweeps, sweep_data):
+    def flatten_value_group(self, a, arrays, sweeps, sweep_data, valids, events):
+        if isinstance(a, EventArray):
+            events[self.name] = a.to_event_signal(sweep_data)
+            return
+        n = len(sweep_data)
         data_array, data_valid = a
-        arrays[self.name] = data_array[data_valid]
+        data_valid = data_valid[:n]  # 途中で終わっている場合は読めた点まで
+        data_array = data_array[:n][data_valid]
+        arrays[self.name] = data_array
         sweeps[self.name] = sweep_data[data_valid]
+        valids[self.name] = data_valid
 
     def to_signal_list(self):
         return [(self, None)]
@@ -248,11 +477,19 @@ class PSF_Group:
 
         return True
 
+    def write(self, psfwriter):
+        psfwriter.write_uint32(ElementId.GROUP)
+        psfwriter.write_uint32(self.id)
+        psfwriter.write_str(self.name)
+        psfwriter.write_uint32(len(self.vars))
+        for v in self.vars:
+            v.write(psfwriter)
+
     def to_array(self, npoints, psffile):
         return [(x, x.to_array(npoints, psffile)) for x in self.vars]
 
-    def to_array_group(self, npoints, psffile):
-        return [(x, x.to_array_group(npoints, psffile)) for x in self.vars]
+    def to_array_group(self, npoints, psffile, events=False):
+        return [(x, x.to_array_group(npoints, psffile, events)) for x in self.vars]
 
     def read_data(self, array, i, psffile):
         for (v, ary) in array:
@@ -262,15 +499,21 @@ class PSF_Group:
         for (v, ary) in array:
             v.read_data_win(ary, start, size, psffile)
 
+    def data_size(self, psffile):
+        sizes = [x.data_size(psffile) for x in self.vars]
+        if None in sizes:
+            return None
+        return sum(sizes)
+
     def flatten_value(self, a, arrays):
         variables = list()
         for (v, ary) in a:
             variables.extend(v.flatten_value(ary, arrays))
         return variables
 
-    def flatten_value_group(self, a, arrays, sweeps, sweep_data):
+    def flatten_value_group(self, a, arrays, sweeps, sweep_data, valids, events):
         for (v, ary) in a:
-            v.flatten_value_group(ary, arrays, sweeps, sweep_data)
+            v.flatten_value_group(ary, arrays, sweeps, sweep_data, valids, events)
 
     def to_signal_list(self):
         signals = list()
@@ -0,0 +1,86 @@
+import numpy as np
+
+
+def resample(sweep, signals, target, method='linear'):
+    '''Resample signals sampled on a sweep onto the target sweep values at once
+
+    sweep: sweep values of the file (monotonic)
+    signals: list of (values, valid). values holds the samples at the sweep points
+             where the boolean mask valid is True (valid is None if all points are valid)
+    method: 'linear' interpolates between the valid samples around a target point,
+            'hold' takes the last valid sample. A list gives the method of each signal.
+    Return a 2-D array of shape (len(target), len(signals)). Target points outside
+    the sweep or without a valid sample of a signal are NaN.'''
+    methods = [method] * len(signals) if isinstance(method, str) else list(method)
+    if len(methods) != len(signals):
+        raise ValueError('Expected ' + str(len(signals)) + ' methods, but ' + str(len(methods)))
+    for m in methods:
+        if m not in ('linear', 'hold'):
+            raise ValueError('Unknown resampling method: ' + repr(m))
+
+    sweep = np.asarray(sweep, dtype=float)
+    target = np.asarray(target, dtype=float)
+    n = len(sweep)
+    k = len(signals)
+    if n > 1 and sweep[-1] < sweep[0]:
+        # 減少するスイープは符号を反転して扱う
+        sweep = -sweep
+        target = -target
+
+    is_complex = any(np.iscomplexobj(v) for (v, _) in signals)
+    values = np.zeros((n, k), dtype=complex if is_complex else float)
+    valid = np.ones((n, k), dtype=bool)
+    for (j, (v, m)) in enumerate(signals):
+        if m is None:
+            values[:len(v), j] = v
+            valid[len(v):, j] = False
+        else:
+            values[m, j] = v
+            valid[:, j] = m
+
+    # 各行以前で最後の有効なサンプル，各行以降で最初の有効なサンプルの行番号
+    rows = np.arange(n)[:, None]
+    prev = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+
+    i = np.searchsorted(sweep, target, side='right') - 1
+    inside = (i >= 0) & (target <= sweep[-1]) if n > 0 else np.zeros(len(target), dtype=bool)
+    i = np.clip(i, 0, max(n - 1, 0))
+    cols = np.arange(k)[None, :]
+
+    result = np.full((len(target), k), np.nan, dtype=values.dtype)
+    if n == 0 or k == 0:
+        return result
+
+    p = prev[i]
+    found = (p >= 0) & inside[:, None]
+    pc = np.maximum(p, 0)
+
+    result[found] = values[pc, cols][found]
+    linear = np.array([m == 'linear' for m in methods])[None, :]
+    if not linear.any():
+        return result
+
+    nxt = np.minimum.accumulate(np.where(valid, rows, n)[::-1], axis=0)[::-1]
+    nxt = np.vstack([nxt, np.full((1, k), n)])
+    q = nxt[i + 1]
+    has_next = q < n
+    qc = np.where(has_next, q, pc)
+
+    xp = sweep[pc]
+    xq = sweep[qc]
+    x = target[:, None]
+    span = xq - xp
+    w = np.where(span != 0, (x - xp) / np.where(span != 0, span, 1), 0.0)
+
+    # 後ろに有効なサンプルがなければ，ちょうどそのスイープ値の点のみ有効
+    result[found & linear] = np.nan
+    found &= linear & (has_next | (x == xp))
+    vp = values[pc, cols]
+    vq = values[qc, cols]
+    result[found] = (vp + w * (vq - vp))[found]
+    return result
+
+
+def uniform_grid(sweep, npoints):
+    '''Return npoints sweep values evenly spaced over the range of the sweep'''
+    return np.linspace(sweep[0], sweep[-1], npoints)
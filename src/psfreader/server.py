@@ -0,0 +1,310 @@
+import io
+import os
+import sys
+import json
+import math
+import socket
+import struct
+import threading
+import argparse
+import http.client
+import http.server
+import urllib.parse
+import concurrent.futures
+import numpy as np
+from psfreader import PSFReader, PSFReaderError
+from psfreader.cache import SignalCache
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class PSFRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Read-only queries on PSF files
+
+    GET /info?file=PATH                       header properties, sweep and signals (JSON)
+    GET /signals?file=PATH                    signal names (JSON)
+    GET /signal?file=PATH&name=NAME           signal values (.npy)
+    GET /sweep?file=PATH[&name=NAME]          sweep values, of the signal if name is given (.npy)
+
+    /signal and /sweep take start, stop and step (a slice of the samples) or
+    points (decimate the slice to about that many points).
+    '''
+
+    protocol_version = 'HTTP/1.1'  # 接続を使い回せるように
+
+    def setup(self):
+        # 次の要求が来ないまま，あるいは読み書きが止まったままの接続はワーカを手放すために閉じる
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = {k: v[-1] for (k, v) in urllib.parse.parse_qs(url.query).items()}
+        self.responded = False
+        try:
+            if url.path == '/info':
+                self.send_json(self.server.get_info(self.open_reader(query)))
+            elif url.path == '/signals':
+                self.send_json(self.open_reader(query).get_signal_names())
+            elif url.path == '/signal':
+                reader = self.open_reader(query)
+                name = self.get_param(query, 'name')
+                self.send_array(self.server.get_array(reader, name, 'signal', self.get_range(query)))
+            elif url.path == '/sweep':
+                reader = self.open_reader(query)
+                name = query.get('name')
+                self.send_array(self.server.get_array(reader, name, 'sweep', self.get_range(query)))
+            else:
+                raise QueryError(404, 'Unknown request: ' + url.path)
+        except QueryError as e:
+            self.send_error_json(e.status, str(e))
+        except (struct.error, KeyError, ValueError, OSError) as e:
+            # 壊れたファイルなど
+            self.send_error_json(500, repr(e))
+
+    def open_reader(self, query):
+        return self.server.open_reader(self.get_param(query, 'file'))
+
+    def get_param(self, query, key):
+        if key not in query:
+            raise QueryError(400, 'Missing parameter: ' + key)
+        return query[key]
+
+    def get_range(self, query):
+        try:
+            keys = ('start', 'stop', 'step', 'points')
+            (start, stop, step, points) = (int(query[k]) if k in query else None for k in keys)
+        except ValueError:
+            raise QueryError(400, 'start, stop, step and points must be integers')
+        if (step is not None and step <= 0) or (points is not None and points <= 0):
+            raise QueryError(400, 'step and points must be positive')
+        return start, stop, step, points
+
+    def send_error_json(self, status, message):
+        if self.responded:
+            # 応答の途中で失敗した場合は接続を閉じるしかない
+            self.close_connection = True
+        else:
+            self.send_json({'error': message}, status)
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.responded = True
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_array(self, array):
+        '''配列を.npy形式で，コピーせずに少しずつ送る'''
+        array = np.ascontiguousarray(array)
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+        header = header.getvalue()
+
+        self.responded = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(header) + array.nbytes))
+        self.end_headers()
+        self.wfile.write(header)
+        data = memoryview(array.reshape(-1).view(np.uint8))
+        chunk_size = 1024 * 1024
+        for i in range(0, len(data), chunk_size):
+            self.wfile.write(data[i:i + chunk_size])
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class PSFServer(http.server.HTTPServer):
+    '''
+    Local read-only PSF query server.
+
+    Decoded files and signals are kept in a SignalCache, so each file is parsed
+    once and later requests from any client only pay for the bytes they ask for.
+    Connections are served by a pool of worker threads. A connection holds its
+    worker while it is open, so connections idle for timeout seconds are closed.
+    Only files under the given root directories can be read.
+    '''
+
+    def __init__(self, roots, address=('127.0.0.1', 8765), workers=8, cache=None, timeout=5.0, verbose=False):
+        super().__init__(address, PSFRequestHandler)
+        self.roots = [os.path.join(os.path.realpath(r), '') for r in roots]
+        self.cache = cache if cache is not None else SignalCache()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.idle_timeout = timeout
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.verbose = verbose
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.add(request)
+        self.pool.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.lock:
+                self.connections.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # 要求を待っているワーカを起こして終了させる
+        with self.lock:
+            for request in self.connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.pool.shutdown(wait=False)
+
+    def open_reader(self, filename):
+        path = os.path.realpath(filename)
+        if not any(path.startswith(r) for r in self.roots):
+            raise QueryError(403, 'Not under the served directories: ' + filename)
+        if not os.path.isfile(path):
+            raise QueryError(404, 'No such file: ' + filename)
+        return PSFReader(path, cache=self.cache)
+
+    def get_info(self, reader):
+        psf = reader.psf
+        if len(psf.sweep_vars) > 0:
+            sweep = {'name': reader.get_sweep_param_name(),
+                     'units': reader.get_signal_units(reader.get_sweep_param_name()),
+                     'npoints': reader.get_sweep_npoints(),
+                     'read_points': reader.get_read_npoints()}
+        else:
+            sweep = None
+
+        signals = list()
+        for name in reader.get_signal_names():
+            t = reader.get_signal_types(name)
+            signals.append({'name': name, 'units': reader.get_signal_units(name),
+                            'type': t.name if t is not None else None})
+
+        properties = dict()
+        for (k, v) in reader.get_header_properties().items():
+            properties[k] = v if not isinstance(v, float) or math.isfinite(v) else repr(v)
+
+        return {'file': psf.filename, 'properties': properties, 'sweep': sweep,
+                'wellformed': reader.is_wellformed(), 'signals': signals}
+
+    def get_array(self, reader, name, kind, selection):
+        (start, stop, step, points) = selection
+        if kind == 'signal':
+            array = reader.get_signal(name)
+        elif name is not None:
+            if name not in reader.get_signal_names():
+                # ウィンドウ形式では信号名によらず共通のスイープ値が返るため
+                raise QueryError(404, 'No such signal: ' + repr(name))
+            array = reader.get_sweep_values_with_var(name)
+        else:
+            array = reader.get_sweep_values()
+        if array is None:
+            raise QueryError(404, 'No such signal: ' + repr(name))
+        array = np.asarray(array)
+        if array.ndim == 0:
+            return array
+
+        (start, stop, step) = slice(start, stop, step).indices(len(array))
+        if points is not None:
+            length = len(range(start, stop, step))
+            step *= max(1, math.ceil(length / points))
+        if (start, stop, step) == (0, len(array), 1):
+            return array
+
+        # 間引いた結果もキャッシュに入れる
+        key = reader.psf.cache_key + ((kind, name), (start, stop, step))
+        view = self.cache.get(key)
+        if view is None:
+            view = np.ascontiguousarray(array[start:stop:step])
+            self.cache.put(key, view, view.nbytes)
+        return view
+
+
+class PSFClient:
+    '''
+    Client of PSFServer reusing one HTTP connection for all requests.
+
+    The connection is opened again if the server has closed it while idle.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=8765, timeout=None):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, path, **params):
+        query = urllib.parse.urlencode({k: v for (k, v) in params.items() if v is not None})
+        try:
+            self.conn.request('GET', path + '?' + query)
+            res = self.conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            self.conn.close()
+            self.conn.request('GET', path + '?' + query)
+            res = self.conn.getresponse()
+        body = res.read()
+        if res.status != 200:
+            raise PSFReaderError(json.loads(body)['error'])
+        return res, body
+
+    def get_info(self, filename):
+        return json.loads(self.request('/info', file=filename)[1])
+
+    def get_signal_names(self, filename):
+        return json.loads(self.request('/signals', file=filename)[1])
+
+    def get_signal(self, filename, name, start=None, stop=None, step=None, points=None):
+        body = self.request('/signal', file=filename, name=name, start=start, stop=stop, step=step, points=points)[1]
+        return np.load(io.BytesIO(body))
+
+    def get_sweep_values(self, filename, name=None, start=None, stop=None, step=None, points=None):
+        body = self.request('/sweep', file=filename, name=name, start=start, stop=stop, step=step, points=points)[1]
+        return np.load(io.BytesIO(body))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local read-only PSF query server')
+    parser.add_argument('root', nargs='+', help='directories of PSF files to serve')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--cache-mb', type=int, default=1024, help='memory budget of decoded signals')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds before closing an idle connection')
+    parser.add_argument('--verbose', action='store_true')
+    opt = parser.parse_args(argv)
+
+    server = PSFServer(opt.root, (opt.host, opt.port), workers=opt.workers,
+                       cache=SignalCache(opt.cache_mb * 1024 * 1024), timeout=opt.timeout, verbose=opt.verbose)
+    print('serving {} on http://{}:{}/'.format(', '.join(opt.root), *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import io
+import struct
+import numpy as np
+from psfreader.psfdata import *
+
+
+class PSFWriter:
+    '''
+    Parameter-Storage Format writer for windowed sweep files (e.g. transient results).
+
+    Signals are appended as NumPy arrays and written as whole window blocks,
+    so a file of any length can be written without holding it in memory.
+    The number of points in the header is updated as blocks are written, so a file
+    which is not closed (e.g. the process died) reads as a truncated file up to the
+    last whole block. close() writes the rest of points and the TOC footer.
+    If the with block raises, the file is left unfinished in the same way.
+
+        with PSFWriter('out.tran', 'time', [('out', 'V'), ('vdd:p', 'A')], sweep_units='s') as w:
+            w.append(time, {'out': v_out, 'vdd:p': i_vdd})
+    '''
+
+    write_size = 16 * 1024 * 1024  # 一度に書き込むブロックの大きさの目安
+
+    def __init__(self, filename, sweep_name, signals, sweep_units=None, properties=None, window_size=4096):
+        '''signals: list of (name, units) or (name, units, TypeId.DOUBLE or TypeId.COMPLEX_DOUBLE)
+        properties: additional header properties (str, int or float values)'''
+        if window_size % 8 != 0 or not (0 < window_size // 8 <= 0xffff):
+            raise ValueError('Invalid window size: ' + repr(window_size))
+        self.window_size = window_size
+        self.block_points = window_size // 8
+
+        self.sections = dict()
+        self.npoints = 0
+        self.pending = None
+        self.closed = False
+
+        self.types = dict()
+        self.sweep_var = self.new_variable(1, sweep_name, sweep_units, TypeId.DOUBLE)
+        self.variables = list()
+        self.dtypes = list()
+        for (i, s) in enumerate(signals):
+            data_type = s[2] if len(s) > 2 else TypeId.DOUBLE
+            self.variables.append(self.new_variable(i + 2, s[0], s[1], data_type))
+            self.dtypes.append(typeid_to_file_dtype(data_type))
+
+        header = dict()
+        for (name, value) in [('PSFversion', '1.00'), ('PSF sweeps', 1),
+                              ('PSF sweep points', 0), ('PSF window size', window_size),
+                              ('PSF traces', len(self.variables))]:
+            header[name] = PSF_Property.from_value(name, value)
+        for (name, value) in (properties or dict()).items():
+            header[name] = PSF_Property.from_value(name, value)
+
+        # 変数と型を確かめてからファイルを作る
+        self.fp = open(filename, 'wb')
+        try:
+            self.write_header(header)
+        except BaseException:
+            self.fp.close()
+            raise
+
+    def new_variable(self, var_id, name, units, data_type):
+        if data_type not in (TypeId.DOUBLE, TypeId.COMPLEX_DOUBLE):
+            raise ValueError('Not supported signal type: ' + repr(data_type))
+
+        # 型は単位とデータ型の組ごとに1つ作る
+        key = (units, data_type)
+        if key not in self.types:
+            typedef = PSF_Type()
+            typedef.id = len(self.types) + 1
+            typedef.name = units if units is not None else TypeId(data_type).name.lower()
+            typedef.data_type = data_type
+            typedef.prop = dict()
+            if units is not None:
+                typedef.prop['units'] = PSF_Property.from_value('units', units)
+            self.types[key] = typedef
+
+        v = PSF_Variable()
+        v.id = var_id
+        v.name = name
+        v.type_id = self.types[key].id
+        v.prop = dict()
+        if units is not None:
+            v.prop['units'] = PSF_Property.from_value('units', units)
+        return v
+
+    def write_uint32(self, x):
+        self.fp.write(struct.pack('>I', x))
+
+    def write_int32(self, x):
+        self.fp.write(struct.pack('>I' if x >= 0 else '>i', x))
+
+    def write_double(self, x):
+        self.fp.write(struct.pack('>d', x))
+
+    def write_str(self, s):
+        data = s.encode()
+        extras = ((len(data) + 3) & ~0x03) - len(data)  # 4byte単位に切り上げたときのパディング
+        self.write_uint32(len(data))
+        self.fp.write(data)
+        self.fp.write(b'\0' * extras)
+
+    def patch_uint32(self, pos, x):
+        cur = self.fp.tell()
+        self.fp.seek(pos, io.SEEK_SET)
+        self.write_uint32(x)
+        self.fp.seek(cur, io.SEEK_SET)
+
+    def begin_section(self, section_num):
+        self.sections[section_num] = self.fp.tell()
+        self.write_uint32(ChunkId.MAJOR_SECTION)
+        self.write_uint32(0)  # 終端位置は後で書き込む
+
+    def end_section(self, section_num, next_section_num=None):
+        '''
+        セクションの終端位置を書き込む
+
+        読み込み側はセクションの終端の直前の語から次のセクションの番号を得る
+        '''
+        if next_section_num is not None:
+            self.write_uint32(next_section_num)
+        self.patch_uint32(self.sections[section_num] + 4, self.fp.tell())
+
+    def begin_minor_section(self):
+        pos = self.fp.tell()
+        self.write_uint32(ChunkId.MINOR_SECTION)
+        self.write_uint32(0)
+        return pos
+
+    def end_minor_section(self, pos):
+        self.patch_uint32(pos + 4, self.fp.tell())
+
+    def write_header(self, header):
+        self.write_uint32(0x0400)
+
+        self.begin_section(SectionId.HEADER)
+        for p in header.values():
+            p.write(self)
+            if p.name == 'PSF sweep points':
+                self.npoints_pos = self.fp.tell() - 4
+        self.end_section(SectionId.HEADER, SectionId.TYPE)
+
+        self.begin_section(SectionId.TYPE)
+        pos = self.begin_minor_section()
+        for typedef in self.types.values():
+            typedef.write(self)
+        self.end_minor_section(pos)
+        self.end_section(SectionId.TYPE, SectionId.SWEEP)
+
+        self.begin_section(SectionId.SWEEP)
+        self.sweep_var.write(self)
+        self.end_section(SectionId.SWEEP, SectionId.TRACE)
+
+        self.begin_section(SectionId.TRACE)
+        pos = self.begin_minor_section()
+        for v in self.variables:
+            v.write(self)
+        self.end_minor_section(pos)
+        self.end_section(SectionId.TRACE, SectionId.VALUE)
+
+        self.begin_section(SectionId.VALUE)
+        self.write_progress()
+
+    def write_progress(self):
+        '''
+        ここまでに書き込んだ点数と値セクションの終端を書き込む
+
+        閉じられなかったファイルも，フッタのない途中までのファイルとして読めるようにする
+        '''
+        self.patch_uint32(self.npoints_pos, self.npoints)
+        self.patch_uint32(self.sections[SectionId.VALUE] + 4, self.fp.tell())
+
+    def block_dtype(self, size):
+        '''size点のウィンドウブロック1つ分の構造'''
+        skip_size = self.window_size - 8 * size
+        fields = [('id', '>u4'), ('size', '>u4'), ('sweep', '>f8', (size,))]
+        for (i, t) in enumerate(self.dtypes):
+            fields.append(('pad%d' % i, 'V%d' % skip_size) if skip_size > 0 else None)
+            fields.append(('v%d' % i, t, (size,)))
+        return np.dtype([f for f in fields if f is not None])
+
+    def write_blocks(self, sweep, values, size):
+        '''size点ずつのブロックをまとめて1回で書き込む'''
+        nblocks = len(sweep) // size
+        blocks = np.zeros(nblocks, dtype=self.block_dtype(size))
+        blocks['id'] = ElementId.DATA
+        blocks['size'] = size
+        blocks['sweep'] = sweep.reshape(nblocks, size)
+        for (i, a) in enumerate(values):
+            blocks['v%d' % i] = a.reshape(nblocks, size)
+        self.fp.write(blocks.tobytes())
+        self.npoints += len(sweep)
+
+    def append(self, sweep, values):
+        '''Append points
+
+        sweep: sweep values
+        values: a dictionary of signal name to values, or a list of values in the order of the signals'''
+        if self.closed:
+            raise ValueError('I/O operation on closed PSFWriter')
+        if isinstance(values, dict):
+            values = [values[v.name] for v in self.variables]
+        if len(values) != len(self.variables):
+            raise ValueError('Expected ' + str(len(self.variables)) + ' signals, but ' + str(len(values)))
+
+        if np.iscomplexobj(sweep):
+            raise ValueError('Sweep values must be real')
+        for (v, a, t) in zip(self.variables, values, self.dtypes):
+            if t.kind != 'c' and np.iscomplexobj(a):
+                # 虚部を黙って捨てない
+                raise ValueError('Complex values for a DOUBLE signal: ' + repr(v.name))
+        sweep = np.asarray(sweep, dtype=float).reshape(-1)
+        values = [np.asarray(a, dtype=t.newbyteorder('=')).reshape(-1) for (a, t) in zip(values, self.dtypes)]
+        for a in values:
+            if len(a) != len(sweep):
+                raise ValueError('Length of signals must be the same as the sweep values')
+
+        npoints = self.npoints
+        if self.pending is not None:
+            # 前回書き込まなかった端数に足してブロックを埋める
+            (pending_sweep, pending_values) = self.pending
+            self.pending = None
+            n = self.block_points - len(pending_sweep)
+            head_sweep = np.concatenate([pending_sweep, sweep[:n]])
+            head_values = [np.concatenate([p, a[:n]]) for (p, a) in zip(pending_values, values)]
+            sweep = sweep[n:]
+            values = [a[n:] for a in values]
+            if len(head_sweep) < self.block_points:
+                self.pending = (head_sweep, head_values)
+                return
+            self.write_blocks(head_sweep, head_values, self.block_points)
+
+        nfull = len(sweep) // self.block_points * self.block_points
+        step = max(1, self.write_size // (self.window_size * (1 + len(values)))) * self.block_points
+        for start in range(0, nfull, step):
+            stop = min(start + step, nfull)
+            self.write_blocks(sweep[start:stop], [a[start:stop] for a in values], self.block_points)
+
+        if nfull < len(sweep):
+            self.pending = (sweep[nfull:].copy(), [a[nfull:].copy() for a in values])
+        if self.npoints > npoints:
+            self.write_progress()
+
+    def close(self):
+        '''Write the rest of points, the number of points and the TOC footer'''
+        if self.closed:
+            return
+        if self.pending is not None:
+            (sweep, values) = self.pending
+            self.write_blocks(sweep, values, len(sweep))
+            self.pending = None
+        self.end_section(SectionId.VALUE)
+        self.patch_uint32(self.npoints_pos, self.npoints)
+
+        toc = self.fp.tell()
+        for (section_num, offset) in self.sections.items():
+            self.write_uint32(section_num)
+            self.write_uint32(offset)
+        self.fp.write(b'Clarissa')
+        self.write_uint32(toc)
+
+        self.fp.close()
+        self.closed = True
+
+    def abort(self):
+        '''Close the file without the rest of points and the TOC footer
+
+        The file is left as a truncated file, which is not well-formed.'''
+        if self.closed:
+            return
+        self.pending = None
+        self.fp.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()